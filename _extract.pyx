@@ -0,0 +1,139 @@
+# cython: language_level=3
+"""
+Compiled `extract_columns()`, the hottest loop in `intercom`.
+
+This must stay in sync with `intercom.python_extract_columns()`, which
+`intercom` uses when this extension isn't built. (`intercom` stays a
+single file, so this module keeps its own copies of the constants;
+test_intercom.py checks the two still agree.)
+"""
+
+import orjson
+
+MissingTimestamp = -(2 ** 63)  # must match `intercom.MissingTimestamp`
+
+# Keys we read from every user, as the str objects orjson puts in its dicts.
+# Must match the keys in `intercom` (see `intercom.decoded_keys()`).
+cdef object EMAIL, NAME, LOCATION_DATA, CITY_NAME
+cdef object COUNTRY_NAME, TIMEZONE, SESSION_COUNT, LAST_REQUEST_AT
+cdef object SOCIAL_PROFILES, USERNAME, COMPANIES, SEGMENTS
+cdef object TAGS, CREATED_AT, UPDATED_AT, ID
+(
+    EMAIL,
+    NAME,
+    LOCATION_DATA,
+    CITY_NAME,
+    COUNTRY_NAME,
+    TIMEZONE,
+    SESSION_COUNT,
+    LAST_REQUEST_AT,
+    SOCIAL_PROFILES,
+    USERNAME,
+    COMPANIES,
+    SEGMENTS,
+    TAGS,
+    CREATED_AT,
+    UPDATED_AT,
+    ID,
+) = tuple(orjson.loads(orjson.dumps(dict.fromkeys((
+    "email",
+    "name",
+    "location_data",
+    "city_name",
+    "country_name",
+    "timezone",
+    "session_count",
+    "last_request_at",
+    "social_profiles",
+    "username",
+    "companies",
+    "segments",
+    "tags",
+    "created_at",
+    "updated_at",
+    "id",
+)))))
+
+
+cpdef dict extract_columns(list users):
+    """
+    Turn `users` into columnar data, in a single pass.
+
+    See `intercom.python_extract_columns()`.
+    """
+    cdef Py_ssize_t i
+    cdef Py_ssize_t n = len(users)
+    cdef dict user
+    cdef dict location
+    cdef object profiles
+    cdef dict profile
+    cdef object service
+    cdef object timestamp
+    cdef list email = [None] * n
+    cdef list name = [None] * n
+    cdef list city = [None] * n
+    cdef list country = [None] * n
+    cdef list session_count = [None] * n
+    cdef list last_request_at = [MissingTimestamp] * n
+    cdef list facebook_username = [None] * n
+    cdef list linkedin_username = [None] * n
+    cdef list twitter_username = [None] * n
+    cdef list companies = [None] * n
+    cdef list segments = [None] * n
+    cdef list tags = [None] * n
+    cdef list timezone = [None] * n
+    cdef list created_at = [MissingTimestamp] * n
+    cdef list updated_at = [MissingTimestamp] * n
+    cdef list user_id = [None] * n
+
+    for i in range(n):
+        user = users[i]
+        location = user.get(LOCATION_DATA) or {}
+        email[i] = user.get(EMAIL)
+        name[i] = user.get(NAME)
+        city[i] = location.get(CITY_NAME)
+        country[i] = location.get(COUNTRY_NAME)
+        session_count[i] = user.get(SESSION_COUNT)
+        timestamp = user.get(LAST_REQUEST_AT)
+        if timestamp is not None:
+            last_request_at[i] = timestamp
+        # 0-3 profiles per user: pick out the services we want
+        profiles = (user.get(SOCIAL_PROFILES) or {}).get(SOCIAL_PROFILES) or ()
+        for profile in profiles:
+            service = profile.get(NAME)
+            if service == "facebook":
+                facebook_username[i] = profile.get(USERNAME)
+            elif service == "linkedin":
+                linkedin_username[i] = profile.get(USERNAME)
+            elif service == "twitter":
+                twitter_username[i] = profile.get(USERNAME)
+        companies[i] = [d[ID] for d in (user.get(COMPANIES) or {}).get(COMPANIES) or ()]
+        segments[i] = [d[ID] for d in (user.get(SEGMENTS) or {}).get(SEGMENTS) or ()]
+        tags[i] = [d[ID] for d in (user.get(TAGS) or {}).get(TAGS) or ()]
+        timezone[i] = location.get(TIMEZONE)
+        timestamp = user.get(CREATED_AT)
+        if timestamp is not None:
+            created_at[i] = timestamp
+        timestamp = user.get(UPDATED_AT)
+        if timestamp is not None:
+            updated_at[i] = timestamp
+        user_id[i] = user.get(ID)
+
+    return {
+        "email": email,
+        "name": name,
+        "city": city,
+        "country": country,
+        "session_count": session_count,
+        "last_request_at": last_request_at,
+        "facebook_username": facebook_username,
+        "linkedin_username": linkedin_username,
+        "twitter_username": twitter_username,
+        "companies": companies,
+        "segments": segments,
+        "tags": tags,
+        "timezone": timezone,
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "id": user_id,
+    }
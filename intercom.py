@@ -1,196 +1,531 @@
+import asyncio
+import hashlib
+import logging
+import time
 from collections import namedtuple
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import httpx
 import numpy as np
+import orjson
 import pandas as pd
+import pyarrow as pa
 from cjwmodule import i18n
 
+logger = logging.getLogger(__name__)
 
 MaxNPages = 50
 USERS_URL = "https://api.intercom.io/users?per_page=60&sort=created_at"
 COMPANIES_URL = "https://api.intercom.io/companies?per_page=60"
-TAGS_URL = "https://api.intercom.io/tags"
-SEGMENTS_URL = "https://api.intercom.io/segments"
-
-
-Columns = [
-    ("email", ["email"]),
-    ("name", ["name"]),
-    ("city", ["location_data", "city_name"]),
-    ("country", ["location_data", "country_name"]),
-    ("session_count", ["session_count"]),
-    ("last_request_at", ["last_request_at"]),
-    ("social_profiles", ["social_profiles", "social_profiles"]),
-    ("companies", ["companies", "companies"]),
-    ("segments", ["segments", "segments"]),
-    ("tags", ["tags", "tags"]),
-    ("timezone", ["location_data", "timezone"]),
-    ("created_at", ["created_at"]),
-    ("updated_at", ["updated_at"]),
-    ("id", ["id"]),
-]
-
-
-def read_raw_value(user: Dict[str, Any], path: List[str]) -> Any:
-    obj = user
-    try:
-        for part in path:
-            obj = obj[part]
-    except KeyError:
-        return None
-    return obj
+# Tags and segments are short lists: ask for Intercom's maximum page size
+TAGS_URL = "https://api.intercom.io/tags?per_page=150"
+SEGMENTS_URL = "https://api.intercom.io/segments?per_page=150"
+MissingTimestamp = np.iinfo(np.int64).min  # same bits as NaT
+LookupCacheTtl = 15 * 60  # seconds to reuse companies/segments/tags
+
+
+# Names of companies, segments and tags, fetched at `fetched_at` (a
+# `time.monotonic()`). `unresolved_ids` holds the `(kind, id)` users
+# referenced that were missing even from a fresh fetch (dangling IDs, or ones
+# past MaxNPages): refetching won't find those either.
+LookupTables = namedtuple(
+    "LookupTables", ["fetched_at", "companies", "segments", "tags", "unresolved_ids"]
+)
+
+
+# lookup_cache_key(bearer_token) => LookupTables
+_lookup_cache: Dict[str, LookupTables] = {}
+_lookup_locks: Dict[str, asyncio.Lock] = {}
 
 
-def read_column(users: List[Dict[str, Any]], path: List[str]) -> pd.Series:
+def decoded_keys(*keys: str) -> Tuple[str, ...]:
     """
-    Build an `np.object`-typed Series for the given column.
+    Return `keys` as the very str objects orjson puts in the dicts it decodes.
+
+    orjson reuses one str object per (short) key across every dict it
+    decodes, so a lookup with that same object matches on identity and
+    skips comparing strings. If orjson hands out other objects, lookups
+    still work: they just compare strings.
+    """
+    return tuple(orjson.loads(orjson.dumps(dict.fromkeys(keys))))
+
+
+# Keys we read from every user
+(
+    EMAIL,
+    NAME,
+    LOCATION_DATA,
+    CITY_NAME,
+    COUNTRY_NAME,
+    TIMEZONE,
+    SESSION_COUNT,
+    LAST_REQUEST_AT,
+    SOCIAL_PROFILES,
+    USERNAME,
+    COMPANIES,
+    SEGMENTS,
+    TAGS,
+    CREATED_AT,
+    UPDATED_AT,
+    ID,
+) = decoded_keys(
+    "email",
+    "name",
+    "location_data",
+    "city_name",
+    "country_name",
+    "timezone",
+    "session_count",
+    "last_request_at",
+    "social_profiles",
+    "username",
+    "companies",
+    "segments",
+    "tags",
+    "created_at",
+    "updated_at",
+    "id",
+)
+
+
+def python_extract_columns(users: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
     """
-    values = [read_raw_value(user, path) for user in users]
-    return pd.Series(values, dtype=np.object)
+    Turn `users` into columnar data, in a single pass.
+
+    Return one list per column, in output-table order. Missing values are
+    `None`, except missing timestamps are `MissingTimestamp` so the lists can
+    become int64 arrays. `companies`, `segments` and `tags` are lists of IDs:
+    we keep no references to `users`' nested objects, so callers can free
+    `users` as soon as this returns.
+    """
+    n = len(users)
+    email = [None] * n
+    name = [None] * n
+    city = [None] * n
+    country = [None] * n
+    session_count = [None] * n
+    last_request_at = [MissingTimestamp] * n
+    facebook_username = [None] * n
+    linkedin_username = [None] * n
+    twitter_username = [None] * n
+    companies = [None] * n
+    segments = [None] * n
+    tags = [None] * n
+    timezone = [None] * n
+    created_at = [MissingTimestamp] * n
+    updated_at = [MissingTimestamp] * n
+    user_id = [None] * n
+
+    for i, user in enumerate(users):
+        location = user.get(LOCATION_DATA) or {}
+        email[i] = user.get(EMAIL)
+        name[i] = user.get(NAME)
+        city[i] = location.get(CITY_NAME)
+        country[i] = location.get(COUNTRY_NAME)
+        session_count[i] = user.get(SESSION_COUNT)
+        timestamp = user.get(LAST_REQUEST_AT)
+        if timestamp is not None:
+            last_request_at[i] = timestamp
+        # 0-3 profiles per user: pick out the services we want
+        profiles = (user.get(SOCIAL_PROFILES) or {}).get(SOCIAL_PROFILES) or ()
+        for profile in profiles:
+            service = profile.get(NAME)
+            if service == "facebook":
+                facebook_username[i] = profile.get(USERNAME)
+            elif service == "linkedin":
+                linkedin_username[i] = profile.get(USERNAME)
+            elif service == "twitter":
+                twitter_username[i] = profile.get(USERNAME)
+        companies[i] = [d[ID] for d in (user.get(COMPANIES) or {}).get(COMPANIES) or ()]
+        segments[i] = [d[ID] for d in (user.get(SEGMENTS) or {}).get(SEGMENTS) or ()]
+        tags[i] = [d[ID] for d in (user.get(TAGS) or {}).get(TAGS) or ()]
+        timezone[i] = location.get(TIMEZONE)
+        timestamp = user.get(CREATED_AT)
+        if timestamp is not None:
+            created_at[i] = timestamp
+        timestamp = user.get(UPDATED_AT)
+        if timestamp is not None:
+            updated_at[i] = timestamp
+        user_id[i] = user.get(ID)
+
+    return {
+        "email": email,
+        "name": name,
+        "city": city,
+        "country": country,
+        "session_count": session_count,
+        "last_request_at": last_request_at,
+        "facebook_username": facebook_username,
+        "linkedin_username": linkedin_username,
+        "twitter_username": twitter_username,
+        "companies": companies,
+        "segments": segments,
+        "tags": tags,
+        "timezone": timezone,
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "id": user_id,
+    }
+
 
+try:
+    # Same function, compiled by Cython (see setup.py). When it isn't built,
+    # we use the pure-Python version above.
+    from _extract import extract_columns
+except ImportError:
+    extract_columns = python_extract_columns
 
-def ids_to_names(objs: pd.Series, names: Dict[str, str]) -> pd.Series:
+
+def timestamps_to_array(timestamps: List[int]) -> pa.TimestampArray:
     """
-    Convert a Series of List[Dict[str, Any]] with "id" keys to a Series of str.
+    Convert UNIX timestamps (or `MissingTimestamp`) to an Arrow array.
+
+    This is all vectorized: no per-value Python None-checks.
     """
+    seconds = np.array(timestamps, dtype=np.int64)
+    return pa.array(seconds, type=pa.timestamp("s"), mask=seconds == MissingTimestamp)
 
-    def find_names(ds: List[Dict[str, str]]):
-        nonlocal names
-        # Remember: `names` might have been truncated in `fetch_paginated()`,
-        # so `id` isn't guaranteed to be in it. Ignore missing IDs.
-        return [names.get(d["id"]) for d in ds if d["id"] in names]
 
-    return pd.Series(
-        ["; ".join(find_names(value)) for value in objs.values], dtype=str
-    ).astype("category")
+def ids_to_names(
+    id_lists: List[List[str]], names: Dict[str, Optional[str]]
+) -> pa.DictionaryArray:
+    """
+    Convert a list of List[str] IDs to dictionary strings.
+    """
+    # Remember: `names` might have been truncated in `fetch_paginated()`,
+    # so `id` isn't guaranteed to be in it. Ignore missing IDs (and nameless
+    # companies, which map to `None`): one `get()` per ID (not `in` then
+    # `get()`), and a local to skip attribute lookups.
+    names_get = names.get
+
+    # Build the dictionary as we go, so nobody needs to re-hash the strings
+    codes = np.empty(len(id_lists), dtype=np.int32)
+    categories: Dict[str, int] = {}
+    for i, ids in enumerate(id_lists):
+        value = "; ".join(name for name in map(names_get, ids) if name is not None)
+        codes[i] = categories.setdefault(value, len(categories))
+    return pa.DictionaryArray.from_arrays(
+        pa.array(codes, type=pa.int32()), pa.array(list(categories), type=pa.string())
+    )
 
 
-def extract_social_media_username(objs: pd.Series, service: str) -> pd.Series:
+def guess_next_page_url(url: str, page: int) -> str:
     """
-    Convert a Series of List[Dict[str, Any]] to a Series of Optional[str].
+    Predict the `pages.next` URL Intercom will return along with page `page`.
+
+    Intercom numbers its pages with a `page` query parameter and leaves the
+    rest of the URL alone.
     """
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "page"]
+    query.append(("page", str(page + 1)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
 
-    def find_username(profiles):
-        nonlocal service
-        try:
-            return next(
-                profile["username"]
-                for profile in profiles
-                if profile["name"] == service
-            )
-        except StopIteration:
-            return np.nan
 
-    return pd.Series([find_username(profiles) for profiles in objs], dtype=str)
+def is_same_url(a: str, b: str) -> bool:
+    """Compare URLs, ignoring the order of query parameters."""
+    a_parts = urlsplit(a)
+    b_parts = urlsplit(b)
+    return a_parts._replace(query="") == b_parts._replace(query="") and sorted(
+        parse_qsl(a_parts.query)
+    ) == sorted(parse_qsl(b_parts.query))
 
 
-async def fetch_paginated(
-    client, bearer_token: str, url: str, data_key: str
-) -> List[Dict[str, Any]]:
+def discard_task(task: asyncio.Future) -> None:
     """
-    Fetch `url` using `access_token`, following pages.
+    Cancel `task`, whose result we no longer want.
 
-    * Stop after `MaxNPages` requests.
-    * Use `pages.next` URL from response to paginate.
-    * Use `data_key` (e.g., "users") from response to find list of results.
+    If it already failed, `cancel()` also marks its exception as handled, so
+    asyncio won't log "Task exception was never retrieved".
     """
-    results: List[Dict[str, Any]] = []
+    task.cancel()
 
-    page_url = url  # we'll modify it as we go
-    for _ in range(MaxNPages):
-        response = await client.get(
-            page_url,
-            headers={
-                "Authorization": f"Bearer {bearer_token}",
-                "Accept": "application/json",
-            },
-        )
-        response.raise_for_status()
-        data = response.json()
-        if not isinstance(data, dict):
-            raise RuntimeError("Intercom did not return a JSON Object")
-        if data_key not in data:
-            raise RuntimeError(f'Intercom did not return "{data_key}" data')
 
-        results.extend(data[data_key])
+async def fetch_page(
+    client, bearer_token: str, url: str, data_key: str
+) -> Dict[str, Any]:
+    """
+    Fetch one page of results from `url`.
 
-        if "pages" in data and data["pages"]["next"]:
-            page_url = data["pages"]["next"]
-        else:
-            break
+    Raise RuntimeError if the response isn't a UTF-8 JSON Object with
+    `data_key`.
+    """
+    response = await client.get(
+        url,
+        headers={
+            "Authorization": f"Bearer {bearer_token}",
+            "Accept": "application/json",
+        },
+    )
+    response.raise_for_status()
+    try:
+        # Parse the raw bytes: never decode the whole body to a str first
+        data = orjson.loads(await response.aread())
+    except orjson.JSONDecodeError as err:
+        # includes invalid UTF-8, which orjson checks as it parses
+        raise RuntimeError(f"Intercom did not return valid JSON: {err}")
+    if not isinstance(data, dict):
+        raise RuntimeError("Intercom did not return a JSON Object")
+    if data_key not in data:
+        raise RuntimeError(f'Intercom did not return "{data_key}" data')
+    return data
 
-    return results
 
+async def fetch_paginated(
+    client, bearer_token: str, url: str, data_key: str, *, prefetch: bool = False
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Fetch `url` using `access_token`, following pages; yield each page's list.
 
-async def fetch_companies(client, bearer_token: str) -> Dict[str, str]:
-    """Fetch mapping from company ID to company name."""
-    companies = await fetch_paginated(client, bearer_token, COMPANIES_URL, "companies")
+    * Stop after `MaxNPages` requests.
+    * Use `pages.next` URL from response to paginate.
+    * Use `data_key` (e.g., "users") from response to find list of results.
+    * If `prefetch`, request the page we expect to come next while we wait
+      for the current one. We only start guessing once page 1's `pages.next`
+      looks like our guess and `total_pages > 1`; and we stop guessing the
+      first time Intercom's `pages.next` disagrees with us.
+    """
+    page_url = url  # we'll modify it as we go
+    last_page = MaxNPages  # we'll lower it if Intercom tells us total_pages
+    task = asyncio.ensure_future(fetch_page(client, bearer_token, page_url, data_key))
+    guess: Optional[Tuple[str, asyncio.Future]] = None
+    try:
+        for page in range(1, MaxNPages + 1):
+            data = await task
+            yield data[data_key]
+
+            if "pages" not in data or not data["pages"]["next"]:
+                break
+            if page == MaxNPages:
+                logger.warning("Truncated %s to its first %d pages", url, MaxNPages)
+                break
+            next_url = data["pages"]["next"]
+            total_pages = data["pages"].get("total_pages") or 0
+            last_page = min(MaxNPages, total_pages or MaxNPages)
+
+            if page == 1:
+                # Only speculate if Intercom paginates the way we'd guess
+                prefetch = (
+                    prefetch
+                    and total_pages > 1
+                    and is_same_url(guess_next_page_url(page_url, page), next_url)
+                )
+
+            if guess is not None and is_same_url(guess[0], next_url):
+                task = guess[1]
+            else:
+                if guess is not None:
+                    discard_task(guess[1])
+                    prefetch = False  # we guessed wrong: stop wasting requests
+                task = asyncio.ensure_future(
+                    fetch_page(client, bearer_token, next_url, data_key)
+                )
+            guess = None
+            page_url = next_url
+
+            if prefetch and page + 1 < last_page:
+                guess_url = guess_next_page_url(page_url, page + 1)
+                guess = (
+                    guess_url,
+                    asyncio.ensure_future(
+                        fetch_page(client, bearer_token, guess_url, data_key)
+                    ),
+                )
+    finally:
+        # On error or early exit, don't leave requests running
+        if not task.done():
+            discard_task(task)
+        if guess is not None:
+            discard_task(guess[1])
+
+
+async def fetch_companies(client, bearer_token: str) -> Dict[str, Optional[str]]:
+    """
+    Fetch mapping from company ID to company name.
+
+    Sometimes a company has no name: map it to `None`, so we still know the
+    company exists.
+    """
     return {
-        company["id"]: company["name"]
+        company["id"]: company.get("name")
+        async for companies in fetch_paginated(
+            client, bearer_token, COMPANIES_URL, "companies"
+        )
         for company in companies
-        if "name" in company  # sometimes it isn't
     }
 
 
 async def fetch_segments(client, bearer_token: str) -> Dict[str, str]:
     """Fetch mapping from segment ID to segment name."""
-    segments = await fetch_paginated(client, bearer_token, SEGMENTS_URL, "segments")
-    return {segment["id"]: segment["name"] for segment in segments}
+    return {
+        segment["id"]: segment["name"]
+        async for segments in fetch_paginated(
+            client, bearer_token, SEGMENTS_URL, "segments"
+        )
+        for segment in segments
+    }
 
 
 async def fetch_tags(client, bearer_token: str) -> Dict[str, str]:
     """Fetch mapping from tag ID to tag name."""
-    tags = await fetch_paginated(client, bearer_token, TAGS_URL, "tags")
-    return {tag["id"]: tag["name"] for tag in tags}
+    return {
+        tag["id"]: tag["name"]
+        async for tags in fetch_paginated(client, bearer_token, TAGS_URL, "tags")
+        for tag in tags
+    }
+
+
+async def fetch_users(client, bearer_token: str) -> Dict[str, List[Any]]:
+    """
+    Fetch users, as columns (see `extract_columns()`).
+
+    Each page is extracted as soon as it arrives, while the next page is
+    still in flight. That leaves little work once the last page is in.
+    """
+    columns = extract_columns([])
+    # Users are the only list that commonly spans many pages
+    async for users in fetch_paginated(
+        client, bearer_token, USERS_URL, "users", prefetch=True
+    ):
+        for name, values in extract_columns(users).items():
+            columns[name].extend(values)
+        # `columns` holds no references into `users`: free the page now,
+        # rather than holding every page's nested dicts until the end
+        users.clear()
+    return columns
+
+
+async def gather_or_cancel(*aws) -> List[Any]:
+    """
+    Await `aws` concurrently, like `asyncio.gather()`.
+
+    If one raises, cancel the rest and wait for them to stop, then re-raise
+    the first exception to occur. (That's the first to fail in time, not
+    necessarily the first in argument order.) Nobody is left using a closed
+    client.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def lookup_cache_key(bearer_token: str) -> str:
+    """Key `_lookup_cache` without keeping the secret in memory."""
+    return hashlib.sha256(bearer_token.encode("utf-8")).hexdigest()
 
 
-async def fetch_users(client, bearer_token: str) -> List[Dict[str, Any]]:
-    return await fetch_paginated(client, bearer_token, USERS_URL, "users")
+def evict_expired_lookup_tables() -> None:
+    """Forget cached lookup tables past `LookupCacheTtl`, and unused locks."""
+    now = time.monotonic()
+    for key, cached in list(_lookup_cache.items()):
+        if now - cached.fetched_at >= LookupCacheTtl:
+            del _lookup_cache[key]
+    for key, lock in list(_lookup_locks.items()):
+        if key not in _lookup_cache and not lock.locked():
+            del _lookup_locks[key]
+
+
+def find_unknown_ids(
+    columns: Dict[str, List[Any]], tables: LookupTables
+) -> Set[Tuple[str, str]]:
+    """
+    Find `(kind, id)` that users reference but `tables` doesn't hold.
+
+    `columns` comes from `extract_columns()`.
+    """
+    return {
+        (kind, id)
+        for kind, names in (
+            ("companies", tables.companies),
+            ("segments", tables.segments),
+            ("tags", tables.tags),
+        )
+        for ids in columns[kind]
+        for id in ids
+        if id not in names
+    }
+
+
+async def fetch_lookup_tables(
+    client, bearer_token: str, *, use_cache: bool = True
+) -> Tuple[bool, LookupTables]:
+    """
+    Fetch (from_cache, tables), reusing a recent result.
+
+    These change far less often than users, so within `LookupCacheTtl` of
+    the last fetch for `bearer_token` we skip the requests (unless
+    `use_cache=False`). A lock per token makes concurrent callers wait for
+    one fetch instead of each starting their own.
+    """
+    evict_expired_lookup_tables()
+    key = lookup_cache_key(bearer_token)
+    lock = _lookup_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        cached = _lookup_cache.get(key)
+        if (
+            use_cache
+            and cached is not None
+            and time.monotonic() - cached.fetched_at < LookupCacheTtl
+        ):
+            return True, cached
+
+        companies, segments, tags = await gather_or_cancel(
+            fetch_companies(client, bearer_token),
+            fetch_segments(client, bearer_token),
+            fetch_tags(client, bearer_token),
+        )
+        tables = LookupTables(time.monotonic(), companies, segments, tags, set())
+        _lookup_cache[key] = tables
+        return False, tables
 
 
 def build_dataframe(
-    users: List[Dict[str, str]],
-    companies: Dict[str, str],
+    columns: Dict[str, List[Any]],
+    companies: Dict[str, Optional[str]],
     segments: Dict[str, str],
     tags: Dict[str, str],
 ) -> pd.DataFrame:
-    # Turn `users` into columnar data. Its `social_profiles`, `companies`,
-    # `segments` and `tags` are all complex objects.
-    table = pd.DataFrame({name: read_column(users, path) for name, path in Columns})
-    # Convert all the types. (They're all np.object)
-    # 'category' is better than np.object for strings that repeat.
-    table["city"] = table["city"].astype("category")
-    table["country"] = table["country"].astype("category")
-    table["session_count"] = table["session_count"].astype(np.int32)
+    # `columns` comes from `extract_columns()`. Its `companies`, `segments`
+    # and `tags` are lists of IDs.
+    #
+    # Build typed Arrow arrays straight from the lists, so pandas never has
+    # to stage (and then copy) object-dtype columns.
+    # dictionary is better than string for strings that repeat.
     # dates are passed as UNIX timestamps
-    table["last_request_at"] = pd.to_datetime(table["last_request_at"], unit="s")
-    table["created_at"] = pd.to_datetime(table["created_at"], unit="s")
-    table["updated_at"] = pd.to_datetime(table["updated_at"], unit="s")
-    table["companies"] = ids_to_names(table["companies"], companies)
-    table["segments"] = ids_to_names(table["segments"], segments)
-    table["tags"] = ids_to_names(table["tags"], tags)
-
-    # social_profiles has one list per user, of 0-3 entries that we must
-    # extract one by one. Delete that one column and replace it with the three
-    # (in the same place, so we get the order we gave in `Columns`).
-    index = table.columns.get_loc("social_profiles")
-    profiles = table.pop("social_profiles")  # modify table in-place
-    table.insert(
-        index, "facebook_username", extract_social_media_username(profiles, "facebook")
-    )
-    table.insert(
-        index + 1,
-        "linkedin_username",
-        extract_social_media_username(profiles, "linkedin"),
-    )
-    table.insert(
-        index + 2,
-        "twitter_username",
-        extract_social_media_username(profiles, "twitter"),
-    )
-
-    return table
+    return pa.table(
+        {
+            "email": pa.array(columns["email"], type=pa.string()),
+            "name": pa.array(columns["name"], type=pa.string()),
+            "city": pa.array(columns["city"], type=pa.string()).dictionary_encode(),
+            "country": pa.array(
+                columns["country"], type=pa.string()
+            ).dictionary_encode(),
+            # Intercom always sends session_count. If a user lacks it, pandas
+            # makes the column float64 with NaN, rather than us crashing.
+            "session_count": pa.array(columns["session_count"], type=pa.int32()),
+            "last_request_at": timestamps_to_array(columns["last_request_at"]),
+            "facebook_username": pa.array(
+                columns["facebook_username"], type=pa.string()
+            ),
+            "linkedin_username": pa.array(
+                columns["linkedin_username"], type=pa.string()
+            ),
+            "twitter_username": pa.array(columns["twitter_username"], type=pa.string()),
+            "companies": ids_to_names(columns["companies"], companies),
+            "segments": ids_to_names(columns["segments"], segments),
+            "tags": ids_to_names(columns["tags"], tags),
+            "timezone": pa.array(columns["timezone"], type=pa.string()),
+            "created_at": timestamps_to_array(columns["created_at"]),
+            "updated_at": timestamps_to_array(columns["updated_at"]),
+            "id": pa.array(columns["id"], type=pa.string()),
+        }
+    ).to_pandas()
 
 
 async def fetch(params, *, secrets):
@@ -200,12 +535,33 @@ async def fetch(params, *, secrets):
     bearer_token = access_token["access_token"]
 
     try:
-        # 5min timeouts ... and we'll assume Intercom is quick enough
-        async with httpx.AsyncClient(timeout=httpx.Timeout(300)) as client:
-            users = await fetch_users(client, bearer_token)
-            companies = await fetch_companies(client, bearer_token)
-            segments = await fetch_segments(client, bearer_token)
-            tags = await fetch_tags(client, bearer_token)
+        # 5min timeouts ... and we'll assume Intercom is quick enough.
+        # HTTP/2 lets our concurrent requests share one connection.
+        async with httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=8),
+            timeout=httpx.Timeout(300),
+        ) as client:
+            # The resource lists are independent: fetch them all at once
+            user_columns, (from_cache, tables) = await gather_or_cancel(
+                fetch_users(client, bearer_token),
+                fetch_lookup_tables(client, bearer_token),
+            )
+            unknown_ids = find_unknown_ids(user_columns, tables)
+            if from_cache and not unknown_ids <= tables.unresolved_ids:
+                # Something was created since we cached: don't drop its name
+                _, tables = await fetch_lookup_tables(
+                    client, bearer_token, use_cache=False
+                )
+                unknown_ids = find_unknown_ids(user_columns, tables)
+            # Whatever a fresh fetch can't name (a dangling ID, or one past
+            # MaxNPages), the next cache hit shouldn't refetch to look for
+            tables.unresolved_ids.update(unknown_ids)
+    except httpx.HTTPStatusError as err:
+        if err.response.status_code in (401, 404):
+            # The token (or its workspace) is gone; so is what it could see
+            _lookup_cache.pop(lookup_cache_key(bearer_token), None)
+        raise
     except httpx.RequestError as err:
         return i18n.trans(
             "error.httpError.general",
@@ -219,4 +575,4 @@ async def fetch(params, *, secrets):
             {"error": str(err)},
         )
 
-    return build_dataframe(users, companies, segments, tags)
+    return build_dataframe(user_columns, tables.companies, tables.segments, tables.tags)
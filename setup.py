@@ -1,6 +1,14 @@
 #!/usr/bin/env python
 
-from setuptools import setup
+from setuptools import Extension, setup
+
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    # intercom.py falls back to pure Python when _extract isn't compiled
+    ext_modules = []
+else:
+    ext_modules = cythonize([Extension("_extract", ["_extract.pyx"])], language_level=3)
 
 setup(
     name="intercom",
@@ -10,6 +18,13 @@ setup(
     author_email="adam@adamhooper.com",
     url="https://github.com/CJWorkbench/intercom",
     packages=[""],
-    py_modules=["libraryofcongress"],
-    install_requires=["pandas==0.25.0", "cjwmodule>=1.3.0"],
+    py_modules=["intercom"],
+    ext_modules=ext_modules,
+    install_requires=[
+        "httpx[http2]",
+        "pandas==0.25.0",
+        "pyarrow>=2.0.0",
+        "orjson>=3.0.0",
+        "cjwmodule>=1.3.0",
+    ],
 )
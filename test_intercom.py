@@ -1,5 +1,528 @@
+import asyncio
+import gc
 import unittest
-from intercom import fetch
+from unittest.mock import patch
+from urllib.parse import urlencode
 
-class FetchTest(unittest.TestCase):
-    pass  # FIXME add tests!
+import httpx
+import numpy as np
+import orjson
+import pandas as pd
+
+import intercom
+from intercom import fetch, fetch_paginated
+
+SECRETS = {"access_token": {"secret": {"access_token": "tok"}}}
+
+
+def page_url(page: int) -> str:
+    """Build the `pages.next` URL Intercom sends for users page `page`."""
+    return f"https://api.intercom.io/users?per_page=60&page={page}&sort=created_at"
+
+
+def cursor_url(cursor: str) -> str:
+    """Build a cursor-style `pages.next` URL, which we can't predict."""
+    return "https://api.intercom.io/users?" + urlencode(
+        {"per_page": 60, "starting_after": cursor}
+    )
+
+
+def users_response(page: int, next_url, total_pages=None) -> httpx.Response:
+    return httpx.Response(
+        200,
+        json={
+            "type": "user.list",
+            "users": [{"id": f"u{page}"}],
+            "pages": {
+                "type": "pages",
+                "next": next_url,
+                "page": page,
+                "per_page": 60,
+                "total_pages": total_pages,
+            },
+        },
+    )
+
+
+def numbered_pages(n_pages: int, failing_pages=()):
+    """Handle `page=N` pagination, like Intercom's users endpoint."""
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        page = int(request.url.params.get("page", "1"))
+        if page in failing_pages or page > n_pages:
+            return httpx.Response(500)
+        next_url = page_url(page + 1) if page < n_pages else None
+        return users_response(page, next_url, n_pages)
+
+    return handle
+
+
+class MockIntercom:
+    """Serve `handle()` through httpx.MockTransport; record requested URLs."""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.requests = []
+
+    def __call__(self, request: httpx.Request):
+        self.requests.append(str(request.url))
+        return self.handle(request)
+
+    def patch_client(self):
+        real_client = httpx.AsyncClient
+        transport = httpx.MockTransport(self)
+
+        def client(**kwargs):
+            return real_client(transport=transport, **kwargs)
+
+        return patch.object(intercom.httpx, "AsyncClient", client)
+
+
+class IntercomTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        intercom._lookup_cache.clear()
+        intercom._lookup_locks.clear()
+
+    def run_checked(self, aw):
+        """
+        Run `aw`; assert it leaves no tasks and no unretrieved exceptions.
+        """
+        errors = []
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            loop.set_exception_handler(lambda loop, context: errors.append(context))
+            try:
+                return await aw
+            finally:
+                await asyncio.sleep(0)  # let cancelled tasks finish
+                self.assertEqual(asyncio.all_tasks() - {asyncio.current_task()}, set())
+
+        try:
+            return asyncio.run(run())
+        finally:
+            gc.collect()  # log "Task exception was never retrieved", if any
+            self.assertEqual(errors, [])
+
+    def fetch_users(self, mock: MockIntercom):
+        async def run():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(mock)) as client:
+                return [
+                    page
+                    async for page in fetch_paginated(
+                        client, "tok", intercom.USERS_URL, "users", prefetch=True
+                    )
+                ]
+
+        return self.run_checked(run())
+
+
+class FetchPaginatedTest(IntercomTest):
+    def test_prefetch_guess_hits(self):
+        mock = MockIntercom(numbered_pages(3))
+        pages = self.fetch_users(mock)
+        self.assertEqual(pages, [[{"id": "u1"}], [{"id": "u2"}], [{"id": "u3"}]])
+        # page 3 was requested speculatively; nothing was wasted
+        self.assertEqual(
+            sorted(mock.requests),
+            sorted(
+                [
+                    intercom.USERS_URL,
+                    page_url(2),
+                    "https://api.intercom.io/users?per_page=60&sort=created_at&page=3",
+                ]
+            ),
+        )
+
+    def test_prefetch_guess_misses_stops_guessing(self):
+        def handle(request):
+            params = request.url.params
+            if "starting_after" in params:
+                n = int(params["starting_after"][1:])
+                next_url = cursor_url(f"u{n + 1}") if n < 5 else None
+                return users_response(n + 1, next_url, 6)
+            page = int(params.get("page", "1"))
+            if page == 1:
+                return users_response(1, page_url(2), 6)
+            elif page == 2:
+                # Intercom switches to cursors: our guess for page 3 is wrong
+                return users_response(2, cursor_url("u2"), 6)
+            else:
+                return httpx.Response(500)
+
+        mock = MockIntercom(handle)
+        pages = self.fetch_users(mock)
+        self.assertEqual(
+            [page[0]["id"] for page in pages], [f"u{i}" for i in range(1, 7)]
+        )
+        # one wasted guess (page 3), then no more guessing
+        self.assertEqual(len(mock.requests), 7)
+        self.assertEqual(sum("page=3" in url for url in mock.requests), 1)
+
+    def test_no_prefetch_for_cursor_pagination(self):
+        def handle(request):
+            cursor = request.url.params.get("starting_after")
+            n = int(cursor[1:]) if cursor else 0
+            next_url = cursor_url(f"u{n + 1}") if n < 3 else None
+            return users_response(n + 1, next_url, 4)
+
+        mock = MockIntercom(handle)
+        pages = self.fetch_users(mock)
+        self.assertEqual(len(pages), 4)
+        self.assertEqual(len(mock.requests), 4)
+
+    def test_no_prefetch_for_single_page(self):
+        mock = MockIntercom(numbered_pages(1))
+        self.assertEqual(self.fetch_users(mock), [[{"id": "u1"}]])
+        self.assertEqual(mock.requests, [intercom.USERS_URL])
+
+    def test_failing_speculative_page_is_discarded(self):
+        async def handle(request):
+            page = int(request.url.params.get("page", "1"))
+            if page == 1:
+                return users_response(1, page_url(2), 3)
+            elif page == 2:
+                await asyncio.sleep(0.01)  # so page 3 fails before we discard it
+                # The list shrank: there is no page 3 after all
+                return users_response(2, None, 2)
+            else:
+                return httpx.Response(500)
+
+        mock = MockIntercom(handle)
+        pages = self.fetch_users(mock)
+        self.assertEqual(pages, [[{"id": "u1"}], [{"id": "u2"}]])
+        self.assertEqual(len(mock.requests), 3)  # page 3 was requested, and failed
+
+    def test_truncate_at_max_n_pages(self):
+        mock = MockIntercom(numbered_pages(3))
+        with patch.object(intercom, "MaxNPages", 2):
+            with self.assertLogs(intercom.logger, "WARNING"):
+                pages = self.fetch_users(mock)
+        self.assertEqual(pages, [[{"id": "u1"}], [{"id": "u2"}]])
+        self.assertEqual(len(mock.requests), 2)  # no guess past MaxNPages
+
+
+class FetchTest(IntercomTest):
+    def test_401_leaves_no_pending_tasks(self):
+        mock = MockIntercom(lambda request: httpx.Response(401))
+        with mock.patch_client():
+            with self.assertRaises(httpx.HTTPStatusError):
+                self.run_checked(fetch({}, secrets=SECRETS))
+
+    def test_invalid_json_is_an_error(self):
+        mock = MockIntercom(lambda request: httpx.Response(200, content=b"\xff{"))
+        with mock.patch_client():
+            result = self.run_checked(fetch({}, secrets=SECRETS))
+        self.assertEqual(result.id, "error.unexpectedIntercomJson.general")
+
+
+def import_compiled_extract():
+    """
+    Import the Cython `_extract` module, compiling it if need be.
+
+    Return None if it isn't built and Cython isn't installed.
+    """
+    try:
+        import _extract
+    except ImportError:
+        try:
+            import pyximport
+        except ImportError:
+            return None
+        pyximport.install(language_level=3)
+        import _extract
+    return _extract
+
+
+class ExtractColumnsTest(unittest.TestCase):
+    def test_compiled_matches_python(self):
+        _extract = import_compiled_extract()
+        if _extract is None:
+            self.skipTest("Cython is not installed")
+
+        users = orjson.loads(
+            orjson.dumps(
+                [
+                    {
+                        "id": "u1",
+                        "email": "a@example.com",
+                        "name": "A",
+                        "session_count": 3,
+                        "last_request_at": 1600000000,
+                        "created_at": 1500000000,
+                        "updated_at": 1550000000,
+                        "location_data": {
+                            "city_name": "Montreal",
+                            "country_name": "Canada",
+                            "timezone": "America/Toronto",
+                        },
+                        "social_profiles": {
+                            "social_profiles": [
+                                {"name": "twitter", "username": "a_tw"},
+                                {"name": "myspace", "username": "a_ms"},
+                                {"name": "facebook", "username": "a_fb"},
+                            ]
+                        },
+                        "companies": {"companies": [{"id": "c1"}, {"id": "c2"}]},
+                        "segments": {"segments": [{"id": "s1"}]},
+                        "tags": {"tags": []},
+                    },
+                    # None everywhere
+                    {
+                        "id": "u2",
+                        "email": None,
+                        "name": None,
+                        "session_count": 0,
+                        "last_request_at": None,
+                        "created_at": None,
+                        "updated_at": None,
+                        "location_data": None,
+                        "social_profiles": None,
+                        "companies": None,
+                        "segments": {"segments": None},
+                        "tags": None,
+                    },
+                    # missing everything
+                    {"id": "u3", "location_data": {}, "social_profiles": {}},
+                    {},
+                ]
+            )
+        )
+        self.assertEqual(_extract.MissingTimestamp, intercom.MissingTimestamp)
+        expected = intercom.python_extract_columns(users)
+        self.assertEqual(_extract.extract_columns(users), expected)
+        self.assertEqual(expected["twitter_username"], ["a_tw", None, None, None])
+        self.assertEqual(
+            expected["last_request_at"],
+            [1600000000] + [intercom.MissingTimestamp] * 3,
+        )
+        self.assertEqual(expected["companies"], [["c1", "c2"], [], [], []])
+
+
+class BuildDataframeTest(unittest.TestCase):
+    def build(self, users, companies={}, segments={}, tags={}):
+        columns = intercom.python_extract_columns(orjson.loads(orjson.dumps(users)))
+        return intercom.build_dataframe(columns, companies, segments, tags)
+
+    def test_columns(self):
+        table = self.build(
+            [
+                {
+                    "id": "u1",
+                    "email": "a@example.com",
+                    "name": "A",
+                    "session_count": 3,
+                    "last_request_at": 1600000000,
+                    "created_at": 1500000000,
+                    "updated_at": None,
+                    "location_data": {
+                        "city_name": "Montreal",
+                        "country_name": "Canada",
+                        "timezone": "America/Toronto",
+                    },
+                    "social_profiles": {
+                        "social_profiles": [{"name": "linkedin", "username": "a_li"}]
+                    },
+                    # c2 has no name; cX is unknown
+                    "companies": {
+                        "companies": [{"id": "c1"}, {"id": "c2"}, {"id": "cX"}]
+                    },
+                    "segments": {"segments": [{"id": "s1"}, {"id": "s2"}]},
+                    "tags": {"tags": []},
+                },
+                {"id": "u2", "session_count": 0},
+            ],
+            companies={"c1": "Co1", "c2": None},
+            segments={"s1": "Seg1", "s2": "Seg2"},
+            tags={"t1": "Tag1"},
+        )
+        self.assertEqual(
+            list(table.columns),
+            [
+                "email",
+                "name",
+                "city",
+                "country",
+                "session_count",
+                "last_request_at",
+                "facebook_username",
+                "linkedin_username",
+                "twitter_username",
+                "companies",
+                "segments",
+                "tags",
+                "timezone",
+                "created_at",
+                "updated_at",
+                "id",
+            ],
+        )
+        for column in ("city", "country", "companies", "segments", "tags"):
+            self.assertEqual(table[column].dtype, "category", column)
+        self.assertEqual(table["session_count"].dtype, np.int32)
+        for column in ("last_request_at", "created_at", "updated_at"):
+            self.assertEqual(table[column].dtype.kind, "M", column)
+
+        self.assertEqual(list(table["id"]), ["u1", "u2"])
+        self.assertEqual(table["city"][0], "Montreal")
+        self.assertTrue(pd.isna(table["city"][1]))
+        self.assertEqual(list(table["session_count"]), [3, 0])
+        self.assertEqual(
+            table["last_request_at"][0], pd.Timestamp("2020-09-13T12:26:40")
+        )
+        self.assertIs(table["last_request_at"][1], pd.NaT)
+        self.assertIs(table["updated_at"][0], pd.NaT)
+        self.assertEqual(table["linkedin_username"][0], "a_li")
+        self.assertTrue(pd.isna(table["linkedin_username"][1]))
+        self.assertEqual(list(table["companies"]), ["Co1", ""])
+        self.assertEqual(list(table["segments"]), ["Seg1; Seg2", ""])
+        self.assertEqual(list(table["tags"]), ["", ""])
+
+    def test_missing_session_count_is_nan(self):
+        table = self.build([{"id": "u1"}, {"id": "u2", "session_count": 2}])
+        self.assertEqual(table["session_count"].dtype, np.float64)
+        self.assertTrue(np.isnan(table["session_count"][0]))
+        self.assertEqual(table["session_count"][1], 2)
+
+
+class FakeIntercom:
+    """Serve users, companies, segments and tags, one page each."""
+
+    def __init__(self):
+        self.status_code = 200
+        self.users = [
+            {
+                "id": "u1",
+                "companies": {"companies": [{"id": "c1"}]},
+                "segments": {"segments": [{"id": "s1"}]},
+                "tags": {"tags": [{"id": "t1"}]},
+            }
+        ]
+        self.companies = [{"id": "c1", "name": "Co1"}]
+        self.segments = [{"id": "s1", "name": "Seg1"}]
+        self.tags = [{"id": "t1", "name": "Tag1"}]
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if self.status_code != 200:
+            return httpx.Response(self.status_code)
+        key = request.url.path[1:]  # "users", "companies", ...
+        return httpx.Response(
+            200, json={key: getattr(self, key), "pages": {"next": None}}
+        )
+
+
+class LookupCacheTest(IntercomTest):
+    def setUp(self):
+        super().setUp()
+        self.intercom = FakeIntercom()
+        self.mock = MockIntercom(self.intercom)
+
+    def fetch(self, token="tok"):
+        self.mock.requests.clear()
+        secrets = {"access_token": {"secret": {"access_token": token}}}
+        with self.mock.patch_client():
+            return self.run_checked(fetch({}, secrets=secrets))
+
+    @property
+    def paths(self):
+        return sorted(httpx.URL(url).path for url in self.mock.requests)
+
+    def age_cache(self, seconds):
+        for key, tables in intercom._lookup_cache.items():
+            intercom._lookup_cache[key] = tables._replace(
+                fetched_at=tables.fetched_at - seconds
+            )
+
+    def test_cache_hit_skips_lookup_tables(self):
+        self.fetch()
+        self.assertEqual(self.paths, ["/companies", "/segments", "/tags", "/users"])
+        self.intercom.companies = [{"id": "c1", "name": "Renamed"}]
+        table = self.fetch()
+        self.assertEqual(self.paths, ["/users"])
+        self.assertEqual(list(table["companies"]), ["Co1"])  # stale, by design
+
+    def test_cache_key_is_not_the_token(self):
+        self.fetch()
+        self.assertEqual(len(intercom._lookup_cache), 1)
+        self.assertNotIn("tok", intercom._lookup_cache)
+        self.assertNotIn("tok", intercom._lookup_locks)
+
+    def test_cache_expires(self):
+        self.fetch()
+        self.intercom.companies = [{"id": "c1", "name": "Renamed"}]
+        self.age_cache(intercom.LookupCacheTtl)
+        table = self.fetch()
+        self.assertEqual(self.paths, ["/companies", "/segments", "/tags", "/users"])
+        self.assertEqual(list(table["companies"]), ["Renamed"])
+
+    def test_evict_expired_entries_and_locks(self):
+        self.fetch("tok")
+        self.age_cache(intercom.LookupCacheTtl)
+        self.fetch("tok2")
+        self.assertEqual(
+            list(intercom._lookup_cache), [intercom.lookup_cache_key("tok2")]
+        )
+        self.assertEqual(
+            list(intercom._lookup_locks), [intercom.lookup_cache_key("tok2")]
+        )
+
+    def test_refetch_on_unknown_id(self):
+        self.fetch()
+        self.intercom.users[0]["companies"]["companies"].append({"id": "c2"})
+        self.intercom.users[0]["tags"]["tags"].append({"id": "t2"})
+        self.intercom.companies.append({"id": "c2", "name": "Co2"})
+        self.intercom.tags.append({"id": "t2", "name": "Tag2"})
+        table = self.fetch()
+        self.assertEqual(self.paths, ["/companies", "/segments", "/tags", "/users"])
+        self.assertEqual(list(table["companies"]), ["Co1; Co2"])
+        self.assertEqual(list(table["tags"]), ["Tag1; Tag2"])
+        # ... and the refetched tables are cached
+        self.fetch()
+        self.assertEqual(self.paths, ["/users"])
+
+    def test_nameless_company_does_not_refetch(self):
+        self.intercom.users[0]["companies"]["companies"].append({"id": "c2"})
+        self.intercom.companies.append({"id": "c2"})
+        self.fetch()
+        table = self.fetch()
+        self.assertEqual(self.paths, ["/users"])
+        self.assertEqual(list(table["companies"]), ["Co1"])
+
+    def test_unresolvable_id_does_not_refetch(self):
+        # e.g., a company deleted since, or one past MaxNPages
+        self.intercom.users[0]["companies"]["companies"].append({"id": "cX"})
+        self.fetch()
+        table = self.fetch()
+        self.assertEqual(self.paths, ["/users"])
+        self.assertEqual(list(table["companies"]), ["Co1"])
+
+    def test_unresolvable_id_found_by_refetch_does_not_refetch(self):
+        self.fetch()
+        self.intercom.users[0]["companies"]["companies"].append({"id": "cX"})
+        self.fetch()
+        self.assertEqual(self.paths, ["/companies", "/segments", "/tags", "/users"])
+        self.fetch()
+        self.assertEqual(self.paths, ["/users"])
+
+    def test_refetch_on_new_id_beside_unresolvable_id(self):
+        self.intercom.users[0]["companies"]["companies"].append({"id": "cX"})
+        self.fetch()
+        self.intercom.users[0]["tags"]["tags"].append({"id": "t2"})
+        self.intercom.tags.append({"id": "t2", "name": "Tag2"})
+        table = self.fetch()
+        self.assertEqual(self.paths, ["/companies", "/segments", "/tags", "/users"])
+        self.assertEqual(list(table["tags"]), ["Tag1; Tag2"])
+
+    def _test_evict_on_status(self, status_code):
+        self.fetch()
+        self.intercom.status_code = status_code
+        with self.assertRaises(httpx.HTTPStatusError):
+            self.fetch()
+        self.assertEqual(intercom._lookup_cache, {})
+
+    def test_evict_on_401(self):
+        self._test_evict_on_status(401)
+
+    def test_evict_on_404(self):
+        self._test_evict_on_status(404)